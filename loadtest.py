@@ -0,0 +1,419 @@
+"""LLMPerception 压力测试驱动
+
+使用桩 Context/配置实例化 MyPlugin，注入可控时钟，并以目标 QPS 通过 my_custom_hook_1
+回放可配置的多平台合成流量，报告吞吐量、尾延迟和内存增长。需要在已安装 AstrBot 的环境中运行：
+
+    python loadtest.py --qps 500 --requests 200000 --start 2025-12-31T23:58:00 --time-scale 600
+    python loadtest.py --qps 0 --duration 60 --jump 50000=2026-02-16T23:59:30 --json
+
+同样的参数和随机种子会产生完全相同的请求序列和模拟时间，报告中的输出摘要可用于比对多次运行的结果。
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from astrbot.core.platform.message_type import MessageType  # noqa: E402
+
+import main  # noqa: E402
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "_conf_schema.json")
+
+# 压测默认配置：关闭逐请求日志，避免日志输出主导延迟
+LOADTEST_CONFIG_OVERRIDES = {
+    "log_level": "ERROR",
+    "enable_detailed_logging": False,
+}
+
+# 延迟直方图：从 100ns 到约 100s，按 2% 等比分桶
+LATENCY_MIN_SECONDS = 1e-7
+LATENCY_BUCKET_GROWTH = 1.02
+LATENCY_LOG_GROWTH = math.log(LATENCY_BUCKET_GROWTH)
+LATENCY_BUCKETS = int(math.log(1e9) / LATENCY_LOG_GROWTH) + 2
+
+DEFAULT_PLATFORMS = {"aiocqhttp": 0.6, "telegram": 0.2, "discord": 0.1, "wecom": 0.1}
+
+SAMPLE_TEXTS = [
+    "今天好开心！",
+    "你好",
+    "这个怎么用？",
+    "气死了😡",
+    "我有点害怕，明天会不会下雨",
+    "太棒了！！谢谢🎉",
+    "不开心😢",
+    "为什么又出错了？！",
+    "收到，明白",
+    "哇，没想到居然成功了😲",
+    "非常失望。",
+    "晚安",
+    "周末有什么安排吗",
+    "新年快乐🥳",
+    "好的",
+]
+
+
+class FakeClock:
+    """可控时钟，返回模拟的 Unix 时间戳"""
+
+    def __init__(self, start: float):
+        self.now = start
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+    def set(self, timestamp: float):
+        self.now = timestamp
+
+
+class StubContext:
+    """MyPlugin 只把 Context 传给 Star 基类，压测中无需任何能力"""
+
+
+class StubConfig(dict):
+    """以 _conf_schema.json 的默认值为基础的配置字典，替代 AstrBotConfig"""
+
+    def __init__(self, overrides: dict = None):
+        super().__init__()
+        with open(SCHEMA_PATH, encoding="utf-8") as f:
+            schema = json.load(f)
+        for key, item in schema.items():
+            if "default" in item:
+                self[key] = item["default"]
+        self.update(LOADTEST_CONFIG_OVERRIDES)
+        self.update(overrides or {})
+
+
+class SyntheticSegment:
+    def __init__(self, seg_type: str, text: str = None):
+        self.type = seg_type
+        self.text = text
+
+
+class SyntheticMessage:
+    def __init__(self, message_type, segments: list):
+        self.type = message_type
+        self.message = segments
+
+
+class SyntheticEvent:
+    """实现插件用到的 AstrMessageEvent 接口子集"""
+
+    def __init__(self, platform_name: str, message_obj: SyntheticMessage, session_id: str):
+        self._platform_name = platform_name
+        self.message_obj = message_obj
+        self.unified_msg_origin = session_id
+        self._extras = {}
+
+    def get_platform_name(self) -> str:
+        return self._platform_name
+
+    def set_extra(self, key, value):
+        self._extras[key] = value
+
+    def get_extra(self, key=None, default=None):
+        if key is None:
+            return self._extras
+        return self._extras.get(key, default)
+
+
+class SyntheticRequest:
+    def __init__(self, prompt: str):
+        self.prompt = prompt
+
+
+class TrafficGenerator:
+    """按种子确定性地生成多平台合成消息"""
+
+    def __init__(
+        self,
+        seed: int,
+        platforms: dict,
+        texts: list,
+        sessions: int,
+        group_ratio: float,
+        media_ratio: float,
+    ):
+        self.random = random.Random(seed)
+        self.platform_names = list(platforms)
+        self.platform_weights = list(platforms.values())
+        self.texts = texts
+        self.sessions = sessions
+        self.group_ratio = group_ratio
+        self.media_ratio = media_ratio
+
+    def next_event(self) -> tuple:
+        """返回 (事件, 请求)"""
+        rnd = self.random
+        platform_name = rnd.choices(self.platform_names, self.platform_weights)[0]
+        is_group = rnd.random() < self.group_ratio
+        message_type = MessageType.GROUP_MESSAGE if is_group else MessageType.FRIEND_MESSAGE
+        text = rnd.choice(self.texts)
+
+        segments = [SyntheticSegment("plain", text)]
+        if rnd.random() < self.media_ratio:
+            segments.append(SyntheticSegment(rnd.choice(["image", "voice", "video"])))
+
+        session_id = f"{platform_name}:{message_type.value}:{rnd.randrange(self.sessions)}"
+        event = SyntheticEvent(platform_name, SyntheticMessage(message_type, segments), session_id)
+        return event, SyntheticRequest(text)
+
+
+def current_rss_bytes():
+    """当前进程常驻内存（仅 Linux），无法获取时返回 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class LatencyHistogram:
+    """固定大小的对数分桶延迟直方图
+
+    内存占用与请求数无关，长时间运行时报告的内存增长只反映插件本身。桶宽按
+    LATENCY_BUCKET_GROWTH 等比增长，分位数的相对误差不超过约 2%。
+    """
+
+    __slots__ = ("counts", "count", "max_value")
+
+    def __init__(self):
+        self.counts = [0] * LATENCY_BUCKETS
+        self.count = 0
+        self.max_value = 0.0
+
+    def record(self, seconds: float):
+        if seconds <= LATENCY_MIN_SECONDS:
+            index = 0
+        else:
+            index = min(
+                int(math.log(seconds / LATENCY_MIN_SECONDS) / LATENCY_LOG_GROWTH) + 1, LATENCY_BUCKETS - 1
+            )
+        self.counts[index] += 1
+        self.count += 1
+        if seconds > self.max_value:
+            self.max_value = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """返回分位数所在桶的上界（不超过观测到的最大值）"""
+        if not self.count:
+            return 0.0
+        rank = min(int(fraction * self.count), self.count - 1)
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen > rank:
+                return min(LATENCY_MIN_SECONDS * LATENCY_BUCKET_GROWTH ** index, self.max_value)
+        return self.max_value
+
+    def summary_us(self) -> dict:
+        return {
+            "p50": self.percentile(0.5) * 1e6,
+            "p90": self.percentile(0.9) * 1e6,
+            "p99": self.percentile(0.99) * 1e6,
+            "p999": self.percentile(0.999) * 1e6,
+            "max": self.max_value * 1e6,
+        }
+
+
+def parse_timestamp(value: str, timezone) -> float:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone)
+    return parsed.timestamp()
+
+
+def parse_jumps(values: list, timezone) -> dict:
+    """解析 --jump 请求序号=ISO时间，在指定请求前把模拟时钟拨到该时间"""
+    jumps = {}
+    for value in values:
+        index, _, target = value.partition("=")
+        jumps[int(index)] = parse_timestamp(target, timezone)
+    return jumps
+
+
+async def run_load_test(args) -> dict:
+    overrides = {}
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            overrides = json.load(f)
+    config = StubConfig(overrides)
+
+    plugin = main.MyPlugin(StubContext(), config)
+    # 替换为可控时钟，并停止按真实时间调度的边界任务（模拟时间下由 now() 按需推进）
+    if plugin._time_context_task:
+        plugin._time_context_task.cancel()
+        plugin._time_context_task = None
+    clock = FakeClock(parse_timestamp(args.start, plugin.timezone))
+    plugin.time_context.clock = clock
+    jumps = parse_jumps(args.jump, plugin.timezone)
+
+    texts = SAMPLE_TEXTS
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    platforms = json.loads(args.platforms) if args.platforms else DEFAULT_PLATFORMS
+    generator = TrafficGenerator(
+        args.seed, platforms, texts, args.sessions, args.group_ratio, args.media_ratio
+    )
+
+    # 每个请求推进的模拟秒数：time_scale 为模拟时间相对于目标 QPS 下真实时间的倍速
+    simulated_step = args.time_scale / args.qps if args.qps > 0 else args.time_scale / 1000
+
+    if args.trace_memory:
+        tracemalloc.start()
+    start_rss = current_rss_bytes()
+    start_traced = tracemalloc.get_traced_memory()[0] if args.trace_memory else None
+
+    # 服务时间从实际发送时刻计时，只反映插件本身；限速时另外统计从计划发送时刻起算的延迟，
+    # 其中包含驱动落后于计划的排队时间（含 sleep 唤醒误差），两者分开报告
+    latencies = LatencyHistogram()
+    interval_latencies = LatencyHistogram()
+    scheduled_latencies = LatencyHistogram() if args.qps > 0 else None
+    output_digest = hashlib.sha256()
+    started = time.perf_counter()
+    last_report = started
+    sent = 0
+
+    while True:
+        if args.requests and sent >= args.requests:
+            break
+        now = time.perf_counter()
+        if args.duration and now - started >= args.duration:
+            break
+
+        # 开环限速：按计划发送时间等待，落后时不补偿等待
+        scheduled = None
+        if args.qps > 0:
+            scheduled = started + sent / args.qps
+            if scheduled > now:
+                await asyncio.sleep(scheduled - now)
+
+        if sent in jumps:
+            clock.set(jumps[sent])
+        event, req = generator.next_event()
+
+        begin = time.perf_counter()
+        await plugin.my_custom_hook_1(event, req)
+        finished = time.perf_counter()
+
+        latencies.record(finished - begin)
+        interval_latencies.record(finished - begin)
+        if scheduled_latencies is not None:
+            scheduled_latencies.record(finished - min(scheduled, begin))
+        output_digest.update(req.prompt.encode("utf-8"))
+        clock.advance(simulated_step)
+        sent += 1
+
+        if args.report_interval and time.perf_counter() - last_report >= args.report_interval:
+            current = time.perf_counter()
+            simulated = datetime.fromtimestamp(clock(), plugin.timezone).strftime("%Y-%m-%d %H:%M:%S")
+            memory = current_rss_bytes()
+            print(
+                f"[{current - started:7.1f}s] 请求 {sent} | 区间 QPS {interval_latencies.count / (current - last_report):.0f} | "
+                f"p50 {interval_latencies.percentile(0.5) * 1e6:.0f}us | p99 {interval_latencies.percentile(0.99) * 1e6:.0f}us | "
+                f"RSS {memory / 1048576 if memory else float('nan'):.1f}MiB | 模拟时间 {simulated}",
+                file=sys.stderr,
+            )
+            interval_latencies = LatencyHistogram()
+            last_report = current
+
+    elapsed = time.perf_counter() - started
+    end_rss = current_rss_bytes()
+    traced = None
+    if args.trace_memory:
+        current_traced, peak_traced = tracemalloc.get_traced_memory()
+        traced = {"start": start_traced, "end": current_traced, "peak": peak_traced}
+        tracemalloc.stop()
+
+    await plugin.terminate()
+
+    return {
+        "requests": sent,
+        "elapsed_seconds": elapsed,
+        "throughput_qps": sent / elapsed if elapsed else 0.0,
+        "latency_us": latencies.summary_us(),
+        "scheduled_latency_us": scheduled_latencies.summary_us() if scheduled_latencies else None,
+        "rss_bytes": {"start": start_rss, "end": end_rss},
+        "traced_memory_bytes": traced,
+        "simulated_end": datetime.fromtimestamp(clock(), plugin.timezone).isoformat(),
+        "tracked_sessions": len(plugin.session_usage),
+        "output_digest": output_digest.hexdigest(),
+    }
+
+
+def format_report(result: dict) -> str:
+    latency = result["latency_us"]
+    lines = [
+        f"请求数: {result['requests']} | 耗时: {result['elapsed_seconds']:.2f}s | 吞吐量: {result['throughput_qps']:.0f} QPS",
+        f"服务时间(us): p50 {latency['p50']:.0f} | p90 {latency['p90']:.0f} | p99 {latency['p99']:.0f} | "
+        f"p99.9 {latency['p999']:.0f} | max {latency['max']:.0f}",
+    ]
+    scheduled = result["scheduled_latency_us"]
+    if scheduled:
+        lines.append(
+            f"按计划发送时间计(us): p50 {scheduled['p50']:.0f} | p90 {scheduled['p90']:.0f} | "
+            f"p99 {scheduled['p99']:.0f} | p99.9 {scheduled['p999']:.0f} | max {scheduled['max']:.0f}"
+        )
+    rss = result["rss_bytes"]
+    if rss["start"] is not None and rss["end"] is not None:
+        lines.append(
+            f"RSS: {rss['start'] / 1048576:.1f}MiB -> {rss['end'] / 1048576:.1f}MiB "
+            f"(+{(rss['end'] - rss['start']) / 1048576:.1f}MiB)"
+        )
+    traced = result["traced_memory_bytes"]
+    if traced:
+        lines.append(
+            f"tracemalloc: {traced['start'] / 1024:.0f}KiB -> {traced['end'] / 1024:.0f}KiB "
+            f"(峰值 {traced['peak'] / 1024:.0f}KiB)"
+        )
+    lines.append(f"模拟结束时间: {result['simulated_end']} | 跟踪会话数: {result['tracked_sessions']}")
+    lines.append(f"输出摘要: {result['output_digest']}")
+    return "\n".join(lines)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="LLMPerception 确定性压力测试")
+    parser.add_argument("--qps", type=float, default=200, help="目标 QPS，0 表示不限速")
+    parser.add_argument("--requests", type=int, default=0, help="总请求数，0 表示不限制")
+    parser.add_argument("--duration", type=float, default=30, help="最长运行秒数，0 表示不限制")
+    parser.add_argument("--start", default="2025-12-31T23:55:00", help="模拟起始时间（ISO 格式，默认使用插件时区）")
+    parser.add_argument("--time-scale", type=float, default=60, help="模拟时间倍速（模拟秒数/真实秒数）")
+    parser.add_argument("--jump", action="append", default=[], help="在第 N 个请求前把模拟时钟拨到指定时间：N=ISO时间，可重复")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--platforms", default="", help='平台权重 JSON，例如 {"aiocqhttp": 0.7, "telegram": 0.3}')
+    parser.add_argument("--texts", default="", help="消息文本文件，每行一条")
+    parser.add_argument("--sessions", type=int, default=500, help="每个平台和消息类型下的会话数")
+    parser.add_argument("--group-ratio", type=float, default=0.6, help="群聊消息比例")
+    parser.add_argument("--media-ratio", type=float, default=0.1, help="含媒体消息比例")
+    parser.add_argument("--config", default="", help="覆盖插件配置的 JSON 文件")
+    parser.add_argument("--report-interval", type=float, default=5, help="区间报告间隔秒数，0 表示关闭")
+    parser.add_argument("--trace-memory", action="store_true", help="使用 tracemalloc 统计 Python 内存（会增加延迟）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出最终报告")
+    return parser
+
+
+def main_cli():
+    args = build_parser().parse_args()
+    if not args.requests and not args.duration:
+        build_parser().error("--requests 和 --duration 不能同时为 0")
+    result = asyncio.run(run_load_test(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2) if args.json else format_report(result))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,8 +1,17 @@
 from __future__ import annotations
 
-from datetime import datetime, date
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator, Mapping
+from datetime import datetime, date, timedelta
+from itertools import groupby, islice
+import asyncio
+import hashlib
+import json
+import marshal
+import os
 import zoneinfo
 import re
+import time
 
 from astrbot.api import logger
 from astrbot.api.event import AstrMessageEvent, filter
@@ -49,12 +58,31 @@ EMOTION_KEYWORDS = {
     "中性": ["正常", "一般", "还行", "可以", "了解", "知道", "明白", "收到", "好的"]
 }
 
+# 语气关键词（陈述为默认语气，不参与关键词计分；标点由 QUESTION_MARKS/EXCLAMATION_MARKS 单独统计）
 TONE_KEYWORDS = {
-    "疑问": ["吗", "呢", "什么", "为什么", "怎么", "如何", "是否", "会不会", "能不能", "可不可以"],
-    "感叹": ["！", "！", "啊", "呀", "哇", "哦", "天哪", "太", "真", "非常", "特别"],
-    "陈述": ["。", "，", "的", "了", "在", "是", "有", "可以", "能够", "应该"]
+    "疑问": ["吗", "呢", "什么", "为什么", "怎么", "如何", "是否", "会不会", "能不能", "可不可以", "为何", "哪里", "何时", "谁", "哪个"],
+    "感叹": ["啊", "呀", "哇", "哦", "天哪", "太", "真", "非常", "特别", "超级", "极其", "无比", "简直", "实在"],
 }
 
+# 修饰词：出现在情感关键词之前的窗口内时，按权重（乘数）调整该关键词的得分
+# 否定词默认权重 -1（反转），程度副词默认 1.5（加强），弱化词默认 0.5（减弱），连续出现时权重相乘
+NEGATION_WORDS = ["不", "没", "没有", "别", "未", "无", "非", "不是", "并不", "从不", "毫不"]
+
+INTENSIFIER_WORDS = {
+    "很": 1.5, "太": 1.5, "真": 1.3, "超": 1.5, "最": 1.8, "更": 1.3, "好生": 1.5,
+    "非常": 1.8, "特别": 1.8, "十分": 1.8, "相当": 1.5, "格外": 1.5, "超级": 2.0,
+    "极其": 2.0, "无比": 2.0, "简直": 1.5, "实在": 1.3,
+}
+
+DIMINISHER_WORDS = {
+    "有点": 0.5, "有些": 0.6, "有一点": 0.5, "一点": 0.5, "稍微": 0.5, "略": 0.6, "略微": 0.6,
+    "些许": 0.5, "还算": 0.7, "不太": -0.5, "不怎么": -0.5, "不是很": -0.5, "不大": -0.5,
+}
+
+# 修饰词生效窗口：修饰词结束后最多间隔的字符数，且中间不能跨越分句标点（单字否定词不允许间隔）
+MODIFIER_WINDOW = 2
+CLAUSE_SEPARATORS = frozenset("，。！？!?,.;；：:~～…\n")
+
 EMOTION_EMOJIS = {
     "开心": "😊",
     "生气": "😠", 
@@ -64,6 +92,699 @@ EMOTION_EMOJIS = {
     "中性": "😐"
 }
 
+# 表情符号情感词典：表情符号 -> (情感, 权重)，表情符号权重高于关键词
+EMOJI_EMOTION_WEIGHTS = {
+    "😊": ("开心", 2.0), "😂": ("开心", 2.0), "😄": ("开心", 2.0), "😍": ("开心", 2.0), "🥰": ("开心", 2.0),
+    "😀": ("开心", 2.0), "😁": ("开心", 2.0), "😆": ("开心", 2.0), "🤣": ("开心", 2.0), "😘": ("开心", 2.0),
+    "🥳": ("开心", 2.0), "😃": ("开心", 1.5), "🙂": ("开心", 1.0), "😉": ("开心", 1.0), "👍": ("开心", 1.0),
+    "🎉": ("开心", 1.5), "❤️": ("开心", 1.5), "❤": ("开心", 1.5),
+    "😠": ("生气", 2.0), "😡": ("生气", 2.0), "🤬": ("生气", 2.5), "💢": ("生气", 2.0), "😤": ("生气", 1.5),
+    "👎": ("生气", 1.0), "🙄": ("生气", 1.0),
+    "😢": ("悲伤", 2.0), "😭": ("悲伤", 2.0), "😔": ("悲伤", 2.0), "🥺": ("悲伤", 2.0), "😞": ("悲伤", 2.0),
+    "😟": ("悲伤", 1.5), "😿": ("悲伤", 1.5), "💔": ("悲伤", 2.0), "☹️": ("悲伤", 1.5), "☹": ("悲伤", 1.5),
+    "😲": ("惊讶", 2.0), "😮": ("惊讶", 2.0), "🤯": ("惊讶", 2.0), "😱": ("惊讶", 2.0), "😯": ("惊讶", 1.5),
+    "😳": ("惊讶", 1.5), "❗": ("惊讶", 1.0), "‼️": ("惊讶", 1.0),
+    "😨": ("恐惧", 2.0), "😰": ("恐惧", 2.0), "😥": ("恐惧", 2.0), "😓": ("恐惧", 2.0), "😧": ("恐惧", 1.5),
+    "😖": ("恐惧", 1.5), "🥶": ("恐惧", 1.0),
+}
+
+# 语气标点字符类
+QUESTION_MARKS = "?？"
+EXCLAMATION_MARKS = "!！"
+
+
+def compile_symbol_pattern(emoji_lexicon: Mapping) -> re.Pattern:
+    """将表情符号词典和语气标点编译为单个正则，一次扫描即可统计所有符号
+
+    较长的表情符号（如带变体选择符的 ❤️）排在前面，保证优先整体匹配。
+    """
+    # 空符号会匹配每个位置，必须排除
+    alternatives = [re.escape(emoji) for emoji in sorted(emoji_lexicon, key=len, reverse=True) if emoji]
+    alternatives.append(f"[{re.escape(QUESTION_MARKS + EXCLAMATION_MARKS)}]")
+    return re.compile("|".join(alternatives))
+
+
+DEFAULT_SYMBOL_PATTERN = compile_symbol_pattern(EMOJI_EMOTION_WEIGHTS)
+
+# 插件数据目录（相对于 AstrBot 工作目录）
+PLUGIN_DATA_DIR = os.path.join("data", "plugin_data", "astrbot_plugin_LLMPerception")
+LEXICON_CACHE_DIR = os.path.join(PLUGIN_DATA_DIR, "lexicon_cache")
+
+
+# 指标名称与说明（导出时统一加 llm_perception_ 前缀）
+METRIC_PREFIX = "llm_perception_"
+METRIC_HELP = {
+    "requests_total": "处理的 LLM 请求数",
+    "prompt_bytes_added_total": "注入提示词的感知信息字节数（UTF-8）",
+    "prompt_tokens_added_total": "注入提示词的感知信息估算 token 数",
+    "truncations_total": "超出提示词开销上限时被裁剪的感知项次数",
+    "injections_skipped_total": "请求中已包含本事件感知信息而跳过注入的次数",
+    "day_status_total": "各日期状态出现次数",
+    "holiday_hits_total": "各节假日命中次数",
+    "rule_hits_total": "各自定义规则触发次数",
+    "emotion_total": "各情感识别结果次数",
+    "tone_total": "各语气识别结果次数",
+    "cache_requests_total": "各缓存的命中/未命中次数",
+    "time_context_advances_total": "时间上下文跨越分钟/时间段/日期边界的次数",
+}
+
+
+class PerceptionMetrics:
+    """进程内计数器，可导出为 Prometheus 文本格式或 JSON"""
+
+    def __init__(self):
+        # (指标名称, 排序后的标签元组) -> 数值
+        self._counters = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """累加计数器"""
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def cache_hit(self, cache: str, hit: bool):
+        """记录一次缓存访问"""
+        self.inc("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    def reset(self):
+        self._counters.clear()
+
+    def snapshot(self) -> dict:
+        """按指标名称分组的快照：{名称: [{"labels": {...}, "value": 数值}]}"""
+        result = {}
+        for (name, labels), value in sorted(self._counters.items()):
+            result.setdefault(name, []).append({"labels": dict(labels), "value": value})
+        return result
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        for name, samples in self.snapshot().items():
+            full_name = f"{METRIC_PREFIX}{name}"
+            lines.append(f"# HELP {full_name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {full_name} counter")
+            for sample in samples:
+                label_text = ",".join(
+                    f'{key}="{_escape_label_value(value)}"' for key, value in sample["labels"].items()
+                )
+                value = sample["value"]
+                value_text = str(int(value)) if float(value).is_integer() else repr(float(value))
+                lines.append(f"{full_name}{{{label_text}}} {value_text}" if label_text else f"{full_name} {value_text}")
+        return "\n".join(lines) + "\n"
+
+    def render(self, fmt: str) -> str:
+        """按格式导出，fmt 为 prometheus/prom 或 json"""
+        if fmt in ("prometheus", "prom"):
+            return self.to_prometheus()
+        return self.to_json()
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# 插件全局指标
+PERCEPTION_METRICS = PerceptionMetrics()
+
+# 编译产物格式版本，修改编译逻辑或内置词典结构时递增，旧缓存自动失效
+LEXICON_FORMAT_VERSION = 4
+
+# 前缀树中标记词语结束的键（单个字符不会与空字符串冲突）
+_TRIE_TERMINAL = ""
+
+BUILTIN_LEXICON = {
+    "emotion": EMOTION_KEYWORDS,
+    "tone": TONE_KEYWORDS,
+    "negators": NEGATION_WORDS,
+    "intensifiers": INTENSIFIER_WORDS,
+    "diminishers": DIMINISHER_WORDS,
+    "emoji": EMOJI_EMOTION_WEIGHTS,
+}
+
+# 修饰词类别及列表形式下的默认权重
+MODIFIER_SECTIONS = {"negators": -1.0, "intensifiers": 1.5, "diminishers": 0.5}
+
+
+class CompiledLexicon:
+    """编译后的词典
+
+    情感关键词、语气关键词和修饰词合并为一棵前缀树，情感分析和语气识别共用同一次扫描；
+    表情符号词典与语气标点编译为单个正则。前缀树节点中 _TRIE_TERMINAL 键保存
+    (类型, 类别, 权重) 条目，类型为 emotion/tone/modifier，修饰词的权重为乘数。
+    """
+
+    __slots__ = ("digest", "trie", "emoji", "symbol_pattern")
+
+    def __init__(self, digest: str, trie: dict, emoji: dict, symbol_pattern: re.Pattern = None):
+        self.digest = digest
+        self.trie = trie
+        self.emoji = emoji
+        self.symbol_pattern = symbol_pattern or compile_symbol_pattern(emoji)
+
+    @classmethod
+    def compile(cls, sources: list, digest: str) -> CompiledLexicon:
+        """将多个词典源按顺序合并编译，后出现的同名词条覆盖先前的权重"""
+        entries = {}
+        emoji = {}
+
+        def add(word, kind: str, category: str, weight):
+            try:
+                weight = float(weight)
+            except (TypeError, ValueError):
+                logger.warning(f"词典中 '{word}' 的权重 {weight!r} 不是数值，已忽略")
+                return
+            word = str(word).strip().lower()
+            if word:
+                entries.setdefault(word, {})[(kind, category)] = weight
+
+        def add_words(kind: str, category: str, words, default_weight: float = 1.0):
+            # 词语可以是列表（使用默认权重）或 {词语: 权重} 字典
+            if isinstance(words, Mapping):
+                for word, weight in words.items():
+                    add(word, kind, category, weight)
+            elif isinstance(words, (list, tuple)):
+                for word in words:
+                    add(word, kind, category, default_weight)
+            else:
+                logger.warning(f"词典中 '{category}' 的词语应为列表或字典，已忽略")
+
+        def section_items(source: Mapping, section: str):
+            value = source.get(section, {})
+            if isinstance(value, Mapping):
+                return value.items()
+            logger.warning(f"词典中 '{section}' 应为字典，已忽略")
+            return ()
+
+        for source in sources:
+            if not isinstance(source, Mapping):
+                logger.warning(f"词典顶层应为 JSON 对象，实际为 {type(source).__name__}，已忽略")
+                continue
+
+            for emotion, words in section_items(source, "emotion"):
+                if emotion not in EMOTION_KEYWORDS:
+                    logger.warning(f"词典中存在未知情感类别 '{emotion}'，已忽略")
+                    continue
+                add_words("emotion", emotion, words)
+
+            for tone, words in section_items(source, "tone"):
+                if tone not in TONE_KEYWORDS:
+                    logger.warning(f"词典中存在未知语气类别 '{tone}'，已忽略")
+                    continue
+                add_words("tone", tone, words)
+
+            for section, default_weight in MODIFIER_SECTIONS.items():
+                add_words("modifier", section, source.get(section, []), default_weight)
+
+            for symbol, value in section_items(source, "emoji"):
+                symbol = str(symbol).strip()
+                if not symbol or symbol in QUESTION_MARKS or symbol in EXCLAMATION_MARKS:
+                    logger.warning(f"表情符号 '{symbol}' 为空或与语气标点冲突，已忽略")
+                    continue
+                # 表情符号可以写成 "情感" 或 [情感, 权重]
+                if isinstance(value, str):
+                    emotion, weight = value, 2.0
+                elif isinstance(value, (list, tuple)) and len(value) == 2:
+                    emotion, weight = value
+                else:
+                    logger.warning(f"表情符号 '{symbol}' 的配置应为 \"情感\" 或 [情感, 权重]，已忽略")
+                    continue
+                if emotion not in EMOTION_KEYWORDS:
+                    logger.warning(f"表情符号 '{symbol}' 对应未知情感类别 '{emotion}'，已忽略")
+                    continue
+                try:
+                    emoji[symbol] = (emotion, float(weight))
+                except (TypeError, ValueError):
+                    logger.warning(f"表情符号 '{symbol}' 的权重 {weight!r} 不是数值，已忽略")
+
+        trie = {}
+        for word, categories in entries.items():
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[_TRIE_TERMINAL] = tuple(
+                (kind, category, weight) for (kind, category), weight in categories.items()
+            )
+
+        return cls(digest, trie, emoji)
+
+    def scan(self, text: str) -> list:
+        """一次扫描找出文本中所有（可重叠的）词典命中，返回按起始位置排序的 (起点, 终点, 条目)"""
+        hits = []
+        trie = self.trie
+        length = len(text)
+
+        for start in range(length):
+            node = trie.get(text[start])
+            end = start + 1
+            while node is not None:
+                found = node.get(_TRIE_TERMINAL)
+                if found:
+                    hits.append((start, end, found))
+                if end >= length:
+                    break
+                node = node.get(text[end])
+                end += 1
+
+        return hits
+
+    def to_artifact(self) -> dict:
+        """转换为可持久化的纯数据结构（正则在加载时重新编译）"""
+        return {
+            "version": LEXICON_FORMAT_VERSION,
+            "digest": self.digest,
+            "trie": self.trie,
+            "emoji": self.emoji,
+        }
+
+
+_BUILTIN_COMPILED_LEXICON = None
+
+
+def _get_builtin_lexicon() -> CompiledLexicon:
+    """内置词典体积很小，直接在内存中编译并复用"""
+    global _BUILTIN_COMPILED_LEXICON
+    if _BUILTIN_COMPILED_LEXICON is None:
+        _BUILTIN_COMPILED_LEXICON = CompiledLexicon.compile([BUILTIN_LEXICON], "builtin")
+        _BUILTIN_COMPILED_LEXICON.symbol_pattern = DEFAULT_SYMBOL_PATTERN
+    return _BUILTIN_COMPILED_LEXICON
+
+
+def load_compiled_lexicon(
+    lexicon_files: list, extra_source: dict = None, cache_dir: str = LEXICON_CACHE_DIR
+) -> CompiledLexicon:
+    """加载内置词典和外部词典文件，编译结果按内容哈希缓存到磁盘
+
+    外部词典为 JSON 文件，相对路径相对于插件数据目录解析。词典内容、额外词典源和
+    LEXICON_FORMAT_VERSION 共同决定哈希值，内容不变时后续启动直接读取缓存，跳过解析和编译。
+    """
+    if not lexicon_files and not extra_source:
+        return _get_builtin_lexicon()
+
+    builtin_bytes = json.dumps(BUILTIN_LEXICON, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    hasher = hashlib.sha256(f"v{LEXICON_FORMAT_VERSION}".encode("utf-8"))
+    hasher.update(builtin_bytes)
+
+    file_contents = []
+    for path in lexicon_files:
+        full_path = path if os.path.isabs(path) else os.path.join(PLUGIN_DATA_DIR, path)
+        try:
+            with open(full_path, "rb") as f:
+                content = f.read()
+        except OSError as e:
+            logger.warning(f"读取词典文件失败: {full_path}, 错误: {e}")
+            continue
+        file_contents.append((full_path, content))
+        hasher.update(content)
+
+    if extra_source:
+        hasher.update(json.dumps(extra_source, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+
+    digest = hasher.hexdigest()
+    cache_path = os.path.join(cache_dir, f"lexicon-{digest}.marshal")
+
+    # 命中磁盘缓存
+    try:
+        with open(cache_path, "rb") as f:
+            artifact = marshal.load(f)
+        if isinstance(artifact, dict) and artifact.get("version") == LEXICON_FORMAT_VERSION and artifact.get("digest") == digest:
+            logger.debug(f"使用词典编译缓存: {cache_path}")
+            PERCEPTION_METRICS.cache_hit("lexicon", True)
+            return CompiledLexicon(digest, artifact["trie"], artifact["emoji"])
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"词典编译缓存损坏，将重新编译: {cache_path}, 错误: {e}")
+
+    # 解析并编译
+    PERCEPTION_METRICS.cache_hit("lexicon", False)
+    sources = [BUILTIN_LEXICON]
+    for full_path, content in file_contents:
+        try:
+            sources.append(json.loads(content.decode("utf-8")))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            logger.warning(f"词典文件格式错误: {full_path}, 错误: {e}")
+    if extra_source:
+        sources.append(extra_source)
+
+    lexicon = CompiledLexicon.compile(sources, digest)
+
+    # 写入磁盘缓存（先写临时文件再替换，避免并发启动读到半个文件）
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            marshal.dump(lexicon.to_artifact(), f)
+        os.replace(tmp_path, cache_path)
+        logger.debug(f"词典编译结果已缓存: {cache_path}")
+    except OSError as e:
+        logger.warning(f"写入词典编译缓存失败: {cache_path}, 错误: {e}")
+
+    return lexicon
+
+# 结构化感知记录在事件上的挂载键，其他插件可通过 event.get_extra(PERCEPTION_EXTRA_KEY) 读取
+PERCEPTION_EXTRA_KEY = "llm_perception"
+# 已渲染的 (注入文本, 是否被裁剪) 在事件上的挂载键，同一事件的多次 LLM 请求复用
+PERCEPTION_BLOCK_EXTRA_KEY = "llm_perception_block"
+
+# 紧凑编码表
+DAY_STATUS_CODES = {"工作日": "W", "周末": "R", "调休工作日": "M", "节假日": "H"}
+PERIOD_CODES = {"上午": "AM", "中午": "NOON", "下午": "PM", "晚上": "EVE", "深夜": "NIGHT"}
+CHAT_TYPE_CODES = {"群聊": "G", "私聊": "P"}
+EMOTION_CODES = {"开心": "JOY", "生气": "ANG", "悲伤": "SAD", "惊讶": "SUR", "恐惧": "FEAR", "中性": "NEU"}
+TONE_CODES = {"疑问": "Q", "感叹": "E", "陈述": "S", "疑问感叹": "QE", "感叹疑问": "EQ"}
+
+
+class PerceptionRecord:
+    """单次消息的结构化感知结果
+
+    未启用的感知项保持空值。rule_outputs 为触发的自定义规则 (规则名称, 内容) 列表，
+    source 为批量接口中的原始输入记录。
+    """
+
+    __slots__ = (
+        "timestamp",
+        "time_text",
+        "weekday",
+        "day_status",
+        "holidays",
+        "period",
+        "platform",
+        "platform_display",
+        "chat_type",
+        "has_image",
+        "has_audio",
+        "has_video",
+        "emotion",
+        "tone",
+        "rule_outputs",
+        "source",
+    )
+
+    def __init__(self, timestamp: datetime, time_text: str):
+        self.timestamp = timestamp
+        self.time_text = time_text
+        self.weekday = ""
+        self.day_status = ""
+        self.holidays = ()
+        self.period = ""
+        self.platform = ""
+        self.platform_display = ""
+        self.chat_type = ""
+        self.has_image = False
+        self.has_audio = False
+        self.has_video = False
+        self.emotion = ""
+        self.tone = ""
+        self.rule_outputs = ()
+        self.source = None
+
+    def shape(self) -> tuple:
+        """除时间戳外决定渲染结果的全部字段，用作文本渲染缓存的键"""
+        return (
+            self.weekday,
+            self.day_status,
+            self.holidays,
+            self.period,
+            self.platform_display,
+            self.chat_type,
+            self.has_image,
+            self.has_audio,
+            self.has_video,
+            self.emotion,
+            self.tone,
+            self.rule_outputs,
+        )
+
+    def to_dict(self) -> dict:
+        """转换为可 JSON 序列化的字典（不含原始输入记录）"""
+        return {
+            "timestamp": self.timestamp.isoformat(),
+            "time_text": self.time_text,
+            "weekday": self.weekday,
+            "day_status": self.day_status,
+            "holidays": list(self.holidays),
+            "period": self.period,
+            "platform": self.platform,
+            "platform_display": self.platform_display,
+            "chat_type": self.chat_type,
+            "has_image": self.has_image,
+            "has_audio": self.has_audio,
+            "has_video": self.has_video,
+            "emotion": self.emotion,
+            "tone": self.tone,
+            "rule_outputs": [{"name": name, "content": content} for name, content in self.rule_outputs],
+        }
+
+    def copy(self) -> PerceptionRecord:
+        """浅拷贝（所有字段均为不可变值）"""
+        clone = PerceptionRecord.__new__(PerceptionRecord)
+        for name in self.__slots__:
+            setattr(clone, name, getattr(self, name))
+        return clone
+
+    def __repr__(self) -> str:
+        return f"PerceptionRecord({self.to_dict()!r})"
+
+
+# 文本渲染缓存：按记录形状缓存时间戳之后的部分
+_PROMPT_SUFFIX_CACHE: dict = {}
+_PROMPT_SUFFIX_CACHE_SIZE = 1024
+
+
+def _render_prompt_suffix(record: PerceptionRecord) -> str:
+    """渲染时间戳之后的感知文本"""
+    parts = []
+
+    if record.weekday:
+        parts.append(", ".join([record.weekday, record.day_status, *record.holidays, record.period]))
+
+    if record.platform_display:
+        platform_parts = [f"平台: {record.platform_display}"]
+        if record.chat_type:
+            platform_parts.append(record.chat_type)
+        if record.has_image:
+            platform_parts.append("含图片")
+        if record.has_audio:
+            platform_parts.append("含语音")
+        if record.has_video:
+            platform_parts.append("含视频")
+        parts.append(", ".join(platform_parts))
+
+    parts.extend(content for _, content in record.rule_outputs)
+
+    if record.emotion and record.emotion != "中性":  # 只有当情感不是中性时才添加
+        parts.append(f"情感:{record.emotion}{EMOTION_EMOJIS.get(record.emotion, '')}")
+    if record.tone:
+        parts.append(f"语气:{record.tone}")
+
+    return "".join(f" | {part}" for part in parts)
+
+
+def render_prompt_text(record: PerceptionRecord) -> str:
+    """渲染为注入提示词的感知文本"""
+    shape = record.shape()
+    suffix = _PROMPT_SUFFIX_CACHE.get(shape)
+    PERCEPTION_METRICS.cache_hit("prompt_render", suffix is not None)
+    if suffix is None:
+        suffix = _render_prompt_suffix(record)
+        if len(_PROMPT_SUFFIX_CACHE) >= _PROMPT_SUFFIX_CACHE_SIZE:
+            _PROMPT_SUFFIX_CACHE.clear()
+        _PROMPT_SUFFIX_CACHE[shape] = suffix
+    return f"发送时间: {record.time_text}{suffix}"
+
+
+def render_json(record: PerceptionRecord) -> str:
+    """渲染为紧凑 JSON 文本"""
+    return json.dumps(record.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+
+# 紧凑编码的分隔符，值中出现时替换为全角字符以保证可以无歧义地解析
+COMPACT_DELIMITER_TRANSLATION = str.maketrans({";": "；", ",": "，", "=": "＝", "/": "／"})
+
+
+def _compact_value(value: str) -> str:
+    """替换值中的紧凑编码分隔符（例如 holidays 库以 "; " 连接同一天的多个节日）"""
+    return "；".join(part.strip() for part in str(value).split(";")).translate(COMPACT_DELIMITER_TRANSLATION)
+
+
+def render_compact(record: PerceptionRecord) -> str:
+    """渲染为紧凑编码，例如 t=2025-10-01 10:00:00;d=3/H/AM;h=中国:国庆节;pf=aiocqhttp/G/I;e=JOY;tn=E"""
+    parts = [f"t={record.time_text}"]
+
+    if record.weekday:
+        weekday_index = WEEKDAY_NAMES.index(record.weekday) + 1
+        day_code = DAY_STATUS_CODES.get(record.day_status, record.day_status)
+        period_code = PERIOD_CODES.get(record.period, record.period)
+        parts.append(f"d={weekday_index}/{day_code}/{period_code}")
+        if record.holidays:
+            parts.append(f"h={','.join(_compact_value(name) for name in record.holidays)}")
+
+    if record.platform:
+        media = "".join(
+            code for code, flag in (("I", record.has_image), ("A", record.has_audio), ("V", record.has_video)) if flag
+        )
+        chat_code = CHAT_TYPE_CODES.get(record.chat_type, "")
+        parts.append("pf=" + "/".join(part for part in (_compact_value(record.platform), chat_code, media) if part))
+
+    if record.emotion:
+        parts.append(f"e={EMOTION_CODES.get(record.emotion, record.emotion)}")
+    if record.tone:
+        parts.append(f"tn={TONE_CODES.get(record.tone, record.tone)}")
+    if record.rule_outputs:
+        parts.append(f"r={','.join(_compact_value(name) for name, _ in record.rule_outputs)}")
+
+    return ";".join(parts)
+
+
+PERCEPTION_RENDERERS = {
+    "text": render_prompt_text,
+    "json": render_json,
+    "compact": render_compact,
+}
+
+# 中日韩字符和全角标点按每字 1 个 token 估算，其余字符按每 4 个字符 1 个 token 估算
+_CJK_CHAR_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的 token 数"""
+    cjk_count = len(_CJK_CHAR_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+# 超出提示词开销上限时各感知项的保留优先级，数值越小越先被裁剪；发送时间始终保留
+# 自定义规则默认优先级为 0（最先裁剪），可在规则中通过 priority 调整
+TRUNCATION_PRIORITIES = {
+    "media": 10,
+    "tone": 20,
+    "emotion": 30,
+    "holidays": 40,
+    "platform": 50,
+    "day": 60,
+}
+
+
+def _drop_record_part(record: PerceptionRecord, part: str) -> bool:
+    """从记录中移除一个感知项（rule:规则名称 表示单条自定义规则），返回记录是否发生变化"""
+    if part.startswith("rule:"):
+        rule_name = part[len("rule:"):]
+        rule_outputs = tuple(item for item in record.rule_outputs if item[0] != rule_name)
+        changed = len(rule_outputs) != len(record.rule_outputs)
+        record.rule_outputs = rule_outputs
+    elif part == "media":
+        changed = record.has_image or record.has_audio or record.has_video
+        record.has_image = record.has_audio = record.has_video = False
+    elif part == "tone":
+        changed = bool(record.tone)
+        record.tone = ""
+    elif part == "emotion":
+        changed = bool(record.emotion)
+        record.emotion = ""
+    elif part == "holidays":
+        changed = bool(record.holidays)
+        record.holidays = ()
+    elif part == "platform":
+        changed = bool(record.platform or record.has_image or record.has_audio or record.has_video)
+        record.platform = record.platform_display = record.chat_type = ""
+        record.has_image = record.has_audio = record.has_video = False
+    elif part == "day":
+        changed = bool(record.weekday or record.holidays)
+        record.weekday = record.day_status = record.period = ""
+        record.holidays = ()
+    else:
+        changed = False
+    return bool(changed)
+
+
+# 提示词开销统计中最多保留的会话数，超出后淘汰最久未活跃的会话
+MAX_TRACKED_SESSIONS = 1000
+
+# 日期级节假日信息缓存的最大条目数
+MAX_CACHED_DAYS = 512
+
+
+class TimeContext:
+    """请求时间上下文
+
+    缓存当前分钟的格式化时间、时间段和日期级节假日信息，只有跨越分钟、时间段或日期边界时
+    才重新进行时区换算和格式化；同一请求的所有阶段共用 now() 返回的同一个时间。
+    clock 返回 Unix 时间戳，可替换为可控时钟用于测试。
+    """
+
+    __slots__ = (
+        "timezone",
+        "clock",
+        "_period_fn",
+        "_day_facts_fn",
+        "_minute_start",
+        "_next_boundary",
+        "_minute_time",
+        "_minute_text",
+        "_hour",
+        "_period",
+        "_date",
+        "_day_facts",
+    )
+
+    def __init__(self, timezone, period_fn, day_facts_fn=None, clock=time.time):
+        self.timezone = timezone
+        self.clock = clock
+        self._period_fn = period_fn
+        self._day_facts_fn = day_facts_fn
+        self._minute_start = float("inf")
+        self._next_boundary = float("-inf")
+        self._minute_time = None
+        self._minute_text = ""
+        self._hour = None
+        self._period = ""
+        self._date = None
+        self._day_facts = None
+
+    def now(self) -> tuple:
+        """返回 (当前时间, 格式化时间, 时间段, 日期级信息)"""
+        timestamp = self.clock()
+        if not self._minute_start <= timestamp < self._next_boundary:
+            self.advance(timestamp)
+
+        offset = timestamp - self._minute_start
+        current_time = self._minute_time + timedelta(seconds=offset)
+        return current_time, f"{self._minute_text}:{int(offset):02d}", self._period, self._day_facts
+
+    def advance(self, timestamp: float):
+        """推进到 timestamp 所在的分钟，按需重新计算时间段和日期级信息"""
+        minute_start = timestamp - timestamp % 60
+        minute_time = datetime.fromtimestamp(minute_start, self.timezone)
+
+        self._minute_start = minute_start
+        self._next_boundary = minute_start + 60
+        self._minute_time = minute_time
+        self._minute_text = minute_time.strftime("%Y-%m-%d %H:%M")
+        PERCEPTION_METRICS.inc("time_context_advances_total", boundary="minute")
+
+        if minute_time.hour != self._hour:
+            period = self._period_fn(minute_time.hour)
+            if period != self._period:
+                PERCEPTION_METRICS.inc("time_context_advances_total", boundary="period")
+            self._hour = minute_time.hour
+            self._period = period
+
+        current_date = minute_time.date()
+        if current_date != self._date:
+            self._date = current_date
+            self._day_facts = self._day_facts_fn(current_date) if self._day_facts_fn else None
+            PERCEPTION_METRICS.inc("time_context_advances_total", boundary="day")
+
+    async def run(self):
+        """在每个分钟边界预先推进，使边界后的第一个请求无需重新计算"""
+        while True:
+            delay = self._next_boundary - self.clock()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            timestamp = self.clock()
+            if timestamp >= self._next_boundary:
+                self.advance(timestamp)
+
 
 @register("add_time", "miaomiao", "让每次请求都携带这次请求的时间", "1.0.0")
 class MyPlugin(Star):
@@ -98,6 +819,63 @@ class MyPlugin(Star):
         self.enable_tone = config.get("enable_tone_detection", True)
         self.emotion_threshold = config.get("emotion_threshold", 0.3)
 
+        # 词典：内置词典 + 外部词典文件 + 配置中的自定义表情符号，编译为情感与语气分析共用的结构
+        custom_emojis = {}
+        for item in config.get("custom_emoji_lexicon", []):
+            if not isinstance(item, Mapping):
+                logger.warning(f"忽略无效的自定义表情符号配置: {item!r}")
+                continue
+            emoji = item.get("emoji", "")
+            emotion = item.get("emotion", "")
+            if not isinstance(emoji, str) or not emoji.strip() or emotion not in EMOTION_KEYWORDS:
+                logger.warning(f"忽略无效的自定义表情符号配置: {item}")
+                continue
+            try:
+                weight = float(item.get("weight", 2.0))
+            except (TypeError, ValueError):
+                logger.warning(f"自定义表情符号 '{emoji}' 的权重 {item.get('weight')!r} 不是数值，已忽略")
+                continue
+            custom_emojis[emoji.strip()] = [emotion, weight]
+        self.lexicon_files = config.get("lexicon_files", [])
+        self.lexicon = load_compiled_lexicon(
+            self.lexicon_files, {"emoji": custom_emojis} if custom_emojis else None
+        )
+
+        # 感知信息渲染格式
+        self.perception_format = config.get("perception_format", "text")
+        if self.perception_format not in PERCEPTION_RENDERERS:
+            logger.warning(f"未知的感知信息渲染格式 '{self.perception_format}'，使用默认格式 text")
+            self.perception_format = "text"
+        self.renderer = PERCEPTION_RENDERERS[self.perception_format]
+
+        # 提示词开销上限（0 表示不限制）
+        self.max_perception_bytes = int(config.get("max_perception_bytes", 2048))
+        self.max_perception_tokens = int(config.get("max_perception_tokens", 0))
+        self.rule_priorities = {}
+        for rule in self.custom_rules:
+            rule_name = rule.get('name', 'unknown')
+            try:
+                self.rule_priorities[rule_name] = int(rule.get('priority', 0))
+            except (TypeError, ValueError):
+                logger.warning(f"自定义规则 '{rule_name}' 的优先级 {rule.get('priority')!r} 不是整数，按 0 处理")
+                self.rule_priorities[rule_name] = 0
+        self._logged_truncations = set()
+        self.platform_usage = {}
+        self.session_usage = OrderedDict()
+
+        # 指标导出配置
+        self.metrics_file = config.get("metrics_file", "")
+        self.metrics_file_format = config.get("metrics_file_format", "prometheus")
+        self.metrics_dump_interval = max(int(config.get("metrics_dump_interval", 60)), 1)
+        self._metrics_task = None
+        if self.metrics_file:
+            if not os.path.isabs(self.metrics_file):
+                self.metrics_file = os.path.join(PLUGIN_DATA_DIR, self.metrics_file)
+            try:
+                self._metrics_task = asyncio.get_running_loop().create_task(self._dump_metrics_periodically())
+            except RuntimeError:
+                logger.warning("当前没有运行中的事件循环，指标文件定时写入未启动")
+
         # 初始化时区
         try:
             self.timezone = zoneinfo.ZoneInfo(timezone_name)
@@ -109,6 +887,20 @@ class MyPlugin(Star):
             self.timezone = zoneinfo.ZoneInfo("Asia/Shanghai")
             timezone_name = "Asia/Shanghai"
 
+        # 时间上下文：按分钟/时间段/日期边界增量更新
+        self._day_facts_cache = {}
+        self.time_context = TimeContext(
+            self.timezone,
+            self._get_time_period,
+            self._get_day_facts if self.enable_holiday else None,
+        )
+        self._time_context_task = None
+        try:
+            self._time_context_task = asyncio.get_running_loop().create_task(self.time_context.run())
+        except RuntimeError:
+            # 没有运行中的事件循环（如离线批量处理）时，时间上下文在访问时按需推进
+            pass
+
         # 记录插件加载信息
         calendar_status = "已启用" if CHINESE_CALENDAR_AVAILABLE else "受限(未安装chinese-calendar)"
         holidays_status = "已启用" if HOLIDAYS_AVAILABLE else "受限(未安装holidays)"
@@ -133,20 +925,24 @@ class MyPlugin(Star):
             f"日志级别: {self.log_level}"
         )
 
-    def _get_holiday_info(self, current_time: datetime) -> str:
-        """获取节假日信息（支持多国家同时识别）"""
-        if not self.enable_holiday:
-            return ""
+    def _get_day_facts(self, current_date: date) -> tuple:
+        """获取日期级别的节假日信息，同一日期的结果会被缓存"""
+        day_facts = self._day_facts_cache.get(current_date)
+        PERCEPTION_METRICS.cache_hit("day_facts", day_facts is not None)
+        if day_facts is None:
+            day_facts = self._compute_day_facts(current_date)
+            if len(self._day_facts_cache) >= MAX_CACHED_DAYS:
+                self._day_facts_cache.clear()
+            self._day_facts_cache[current_date] = day_facts
+        return day_facts
 
-        info_parts = []
+    def _compute_day_facts(self, current_date: date) -> tuple:
+        """获取日期级别的节假日信息（支持多国家同时识别）
 
-        # 判断是否为周末
-        weekday = current_time.weekday()
-        info_parts.append(WEEKDAY_NAMES[weekday])
+        返回 (星期名称, 日期状态, 节假日列表)，日期状态为 节假日/工作日/调休工作日/周末。
+        """
+        weekday = current_date.weekday()
 
-        # 获取当前日期
-        current_date = date(current_time.year, current_time.month, current_time.day)
-        
         # 存储检测到的节假日信息
         holiday_detections = []
         workday_status = None
@@ -374,88 +1170,60 @@ class MyPlugin(Star):
         
         # 处理节假日检测结果
         if holiday_detections:
-            # 如果有检测到节假日，添加节假日信息
-            info_parts.append("节假日")
-            # 添加所有检测到的节假日名称
-            info_parts.extend(holiday_detections)
-        else:
-            # 如果没有检测到节假日，设置工作日状态
-            if workday_status is None:
-                # 如果没有中国节假日库的精确判断，使用简单周末判断
-                if weekday >= 5:
-                    workday_status = "周末"
-                else:
-                    workday_status = "工作日"
-            
-            info_parts.append(workday_status)
+            # 如果有检测到节假日，日期状态为节假日并附带所有检测到的节假日名称
+            return WEEKDAY_NAMES[weekday], "节假日", tuple(holiday_detections)
 
-        # 判断时间段
-        hour = current_time.hour
+        # 如果没有检测到节假日，设置工作日状态
+        if workday_status is None:
+            # 如果没有中国节假日库的精确判断，使用简单周末判断
+            if weekday >= 5:
+                workday_status = "周末"
+            else:
+                workday_status = "工作日"
+
+        return WEEKDAY_NAMES[weekday], workday_status, ()
+
+    def _get_time_period(self, hour: int) -> str:
+        """根据小时判断时间段"""
         if 5 <= hour < 12:
-            time_period = "上午"
+            return "上午"
         elif 12 <= hour < 14:
-            time_period = "中午"
+            return "中午"
         elif 14 <= hour < 18:
-            time_period = "下午"
+            return "下午"
         elif 18 <= hour < 22:
-            time_period = "晚上"
+            return "晚上"
         else:
-            time_period = "深夜"
-        info_parts.append(time_period)
-
-        return ", ".join(info_parts)
-
-    def _get_platform_info(self, event: AstrMessageEvent) -> str:
-        """获取平台环境信息"""
-        if not self.enable_platform:
-            return ""
+            return "深夜"
 
-        info_parts = []
+    def _get_message_facts(self, event: AstrMessageEvent) -> tuple:
+        """获取消息的平台、消息类型和媒体信息，返回 (平台名称, 消息类型, 含图片, 含语音, 含视频)"""
+        message_obj = event.message_obj
+        message_type = message_obj.type if message_obj else None
 
-        # 平台类型
-        platform_name = event.get_platform_name()
-        platform_display = PLATFORM_DISPLAY_NAMES.get(platform_name, platform_name)
-        info_parts.append(f"平台: {platform_display}")
+        # 消息类型
+        has_image = has_audio = has_video = False
+        if message_obj and hasattr(message_obj, 'message'):
+            has_image = any(seg.type == "image" for seg in message_obj.message)
+            has_audio = any(seg.type in ["voice", "audio"] for seg in message_obj.message)
+            has_video = any(seg.type == "video" for seg in message_obj.message)
 
-        # 判断是群聊还是私聊（通过 MessageType 判断）
+        return event.get_platform_name(), message_type, has_image, has_audio, has_video
 
-        if event.message_obj and event.message_obj.type == MessageType.GROUP_MESSAGE:
-            info_parts.append("群聊")
-        elif event.message_obj and event.message_obj.type == MessageType.FRIEND_MESSAGE:
-            info_parts.append("私聊")
+    def _get_chat_type(self, message_type) -> str:
+        """判断是群聊还是私聊（通过 MessageType 判断）"""
+        if message_type == MessageType.GROUP_MESSAGE:
+            return "群聊"
+        elif message_type == MessageType.FRIEND_MESSAGE:
+            return "私聊"
+        return ""
 
-        # 消息类型
-        message_chain = event.message_obj
-        if message_chain and hasattr(message_chain, 'message'):
-            has_image = any(seg.type == "image" for seg in message_chain.message)
-            has_audio = any(seg.type in ["voice", "audio"] for seg in message_chain.message)
-            has_video = any(seg.type == "video" for seg in message_chain.message)
-
-            if has_image:
-                info_parts.append("含图片")
-            if has_audio:
-                info_parts.append("含语音")
-            if has_video:
-                info_parts.append("含视频")
-
-        return ", ".join(info_parts)
-
-    def _get_custom_perception_info(self, current_time: datetime, event: AstrMessageEvent) -> str:
-        """获取自定义感知信息"""
+    def _apply_custom_rules(self, variables: dict) -> tuple:
+        """依次评估自定义规则，返回触发规则的 (规则名称, 内容) 列表"""
         if not self.enable_custom or not self.custom_rules:
-            return ""
+            return ()
 
         custom_parts = []
-        platform_name = event.get_platform_name()
-        message_type = event.message_obj.type if event.message_obj else None
-
-        # 创建可用的变量字典
-        variables = {
-            'current_time': current_time,
-            'event': event,
-            'platform_name': platform_name,
-            'message_type': message_type
-        }
 
         # 处理每条自定义规则
         for rule in self.custom_rules:
@@ -475,7 +1243,7 @@ class MyPlugin(Star):
                     content = rule['content']
                     custom_content = self._process_content_template(content, variables)
                     if custom_content:
-                        custom_parts.append(custom_content)
+                        custom_parts.append((rule.get('name', 'unknown'), custom_content))
                         self._log_message("DEBUG", f"自定义规则触发: {rule.get('name', 'unknown')} -> {custom_content}")
                 else:
                     self._log_message("DEBUG", f"自定义规则未触发: {rule.get('name', 'unknown')}")
@@ -485,35 +1253,77 @@ class MyPlugin(Star):
                 self._log_message("WARNING", error_msg)
                 logger.warning(error_msg)
 
-        return " | ".join(custom_parts)
+        return tuple(custom_parts)
 
-    def _get_emotion_info(self, event: AstrMessageEvent) -> str:
-        """获取情感状态信息"""
-        if not self.enable_emotion:
-            return ""
+    def _analyze_text(self, message_text: str) -> tuple:
+        """对消息文本进行情感分析和语气识别，返回 (情感, 语气)"""
+        if not self.enable_emotion or not message_text:
+            return "", ""
 
-        # 提取消息文本
-        message_text = self._extract_message_text(event)
-        if not message_text:
-            return ""
-
-        emotion_parts = []
+        # 表情符号、标点和关键词只扫描一次，情感分析与语气识别共用
+        features = self._extract_features(message_text)
 
         # 情感分析
-        emotion_result = self._analyze_emotion(message_text)
-        if emotion_result and emotion_result != "中性":  # 只有当情感不是中性时才添加
-            emotion_emoji = EMOTION_EMOJIS.get(emotion_result, "")
-            emotion_parts.append(f"情感:{emotion_result}{emotion_emoji}")
-            self._log_message("DEBUG", f"情感分析结果: {emotion_result}")
+        emotion_result = self._analyze_emotion(message_text, features)
+        self._log_message("DEBUG", f"情感分析结果: {emotion_result}")
 
         # 语气识别
+        tone_result = ""
         if self.enable_tone:
-            tone_result = self._analyze_tone(message_text)
-            if tone_result:
-                emotion_parts.append(f"语气:{tone_result}")
-                self._log_message("DEBUG", f"语气识别结果: {tone_result}")
+            tone_result = self._analyze_tone(message_text, features)
+            self._log_message("DEBUG", f"语气识别结果: {tone_result}")
+
+        return emotion_result, tone_result
+
+    def _build_record(
+        self,
+        current_time: datetime,
+        time_text: str,
+        period: str,
+        day_facts: tuple,
+        message_facts: tuple,
+        text_result: tuple,
+        rule_outputs: tuple,
+        source=None,
+    ) -> PerceptionRecord:
+        """根据各阶段的计算结果组装结构化感知记录"""
+        record = PerceptionRecord(current_time, time_text)
+
+        if self.enable_holiday:
+            record.weekday, record.day_status, record.holidays = day_facts
+            record.period = period
+
+        if self.enable_platform:
+            platform_name, message_type, has_image, has_audio, has_video = message_facts
+            record.platform = platform_name
+            record.platform_display = PLATFORM_DISPLAY_NAMES.get(platform_name, platform_name)
+            record.chat_type = self._get_chat_type(message_type)
+            record.has_image = has_image
+            record.has_audio = has_audio
+            record.has_video = has_video
+
+        record.emotion, record.tone = text_result
+        record.rule_outputs = rule_outputs
+        record.source = source
+        return record
+
+    def _perceive_event(self, event: AstrMessageEvent, time_snapshot: tuple) -> PerceptionRecord:
+        """计算单个消息事件的感知记录，time_snapshot 为 TimeContext.now() 的返回值"""
+        current_time, time_text, period, day_facts = time_snapshot
+        message_facts = self._get_message_facts(event)
+        text_result = self._analyze_text(self._extract_message_text(event))
+
+        # 创建可用的变量字典
+        rule_outputs = self._apply_custom_rules({
+            'current_time': current_time,
+            'event': event,
+            'platform_name': message_facts[0],
+            'message_type': message_facts[1]
+        })
 
-        return " | ".join(emotion_parts)
+        return self._build_record(
+            current_time, time_text, period, day_facts, message_facts, text_result, rule_outputs
+        )
 
     def _extract_message_text(self, event: AstrMessageEvent) -> str:
         """从消息事件中提取文本内容"""
@@ -527,15 +1337,15 @@ class MyPlugin(Star):
         
         return " ".join(text_parts)
 
-    def _analyze_emotion(self, text: str) -> str:
+    def _analyze_emotion(self, text: str, features: tuple = None) -> str:
         """分析文本情感（基于规则的方法）"""
         if self.emotion_method == "rule_based":
-            return self._rule_based_emotion_analysis(text)
+            return self._rule_based_emotion_analysis(text, features)
         else:
             # 预留机器学习方法
-            return self._rule_based_emotion_analysis(text)
+            return self._rule_based_emotion_analysis(text, features)
 
-    def _rule_based_emotion_analysis(self, text: str) -> str:
+    def _rule_based_emotion_analysis(self, text: str, features: tuple = None) -> str:
         """基于规则的情感分析"""
         if not text or len(text.strip()) == 0:
             return "中性"
@@ -544,17 +1354,55 @@ class MyPlugin(Star):
         
         # 预处理文本
         cleaned_text = self._preprocess_text(text)
+        if features is None:
+            features = self._extract_features(text)
+        symbols, hits = features
         
-        # 从表情符号检测情绪
-        emoji_emotion, emoji_score = self._detect_emotion_from_emoji(text)
-        if emoji_emotion:
-            emotion_scores[emoji_emotion] += emoji_score
+        # 从表情符号检测情绪（累计文本中所有表情符号的权重）
+        for emotion, score in symbols[0].items():
+            emotion_scores[emotion] += score
         
-        # 关键词匹配
-        for emotion, keywords in EMOTION_KEYWORDS.items():
-            for keyword in keywords:
-                if self._contains_word(cleaned_text, keyword):
-                    emotion_scores[emotion] += 1.0
+        # 关键词匹配：单次遍历命中列表，用窗口状态机把修饰词的乘数作用到随后的情感关键词上
+        multiplier = 1.0  # 当前待生效的修饰乘数
+        window_end = -1  # 修饰词生效窗口的结束位置
+        modifier_end = -1  # 最近一个修饰词的结束位置
+        reach = 0  # 已处理命中覆盖到的最远位置
+        for start, group in groupby(hits, key=lambda hit: hit[0]):
+            group = list(group)
+
+            # 超出窗口或跨越分句标点时修饰状态失效
+            if multiplier != 1.0 and (
+                start > window_end
+                or any(char in CLAUSE_SEPARATORS for char in cleaned_text[modifier_end:start])
+            ):
+                multiplier = 1.0
+
+            scored = False
+            after_modifier = multiplier != 1.0 and modifier_end == start
+            for _, end, entries in group:
+                for kind, category, weight in entries:
+                    if kind != "emotion" or not self._is_word_boundary(cleaned_text, start, end, after_modifier):
+                        continue
+                    emotion_scores[category] += weight * multiplier
+                    scored = True
+            _, longest_end, longest_entries = group[-1]
+            if scored:
+                # 修饰词只作用于紧随其后的一个情感关键词
+                multiplier = 1.0
+            elif start >= reach:
+                # 同一位置以最长的词为准，被更长词语覆盖的修饰词（如"特别"中的"别"）不生效
+                for kind, _, weight in longest_entries:
+                    if kind == "modifier":
+                        multiplier *= weight
+                        modifier_end = longest_end
+                        # 单字否定词常出现在普通词语中（如"别人"、"未来"、"无聊"），
+                        # 只作用于紧随其后的关键词或修饰词，不允许间隔
+                        if weight < 0 and longest_end - start == 1:
+                            window_end = longest_end
+                        else:
+                            window_end = longest_end + MODIFIER_WINDOW
+                        break
+            reach = max(reach, longest_end)
         
         # 找到最高分的情绪
         max_emotion = "中性"
@@ -565,9 +1413,8 @@ class MyPlugin(Star):
                 max_score = score
                 max_emotion = emotion
         
-        # 设置阈值（降低到0.5以提高敏感度）
-        threshold = 0.5
-        if max_score < threshold:
+        # 低于配置阈值（或被否定为非正分）时视为中性
+        if max_score <= 0 or max_score < self.emotion_threshold:
             return "中性"
         
         return max_emotion
@@ -576,46 +1423,51 @@ class MyPlugin(Star):
         """预处理文本"""
         # 转换为小写进行匹配
         return text.lower()
+
+    def _extract_features(self, text: str) -> tuple:
+        """扫描文本，返回 (表情符号与标点统计, 词典命中列表)"""
+        return self._scan_symbols(text), self.lexicon.scan(self._preprocess_text(text))
     
-    def _contains_word(self, text: str, word: str) -> bool:
-        """检查文本是否包含特定词语（优化的中文匹配）"""
-        # 对于中文，使用更智能的匹配方式
-        # 主要目标是避免单字关键词的部分匹配问题
-        
-        # 如果关键词是单字，需要更严格的边界检查
-        if len(word) == 1:
-            # 单字关键词：使用正则表达式检查是否作为独立词语
-            # 更宽松的边界检查：允许在非中文字符边界出现
-            pattern = r'(^|[^\u4e00-\u9fff])' + re.escape(word) + r'([^\u4e00-\u9fff]|$)'
-            return bool(re.search(pattern, text))
-        else:
-            # 多字关键词：直接使用in检查，因为多字词不容易出现部分匹配问题
-            # 例如"开心"在"我很开心"中是完整匹配，在"开心果"中也是完整匹配
-            return word in text
-    
-    def _detect_emotion_from_emoji(self, text: str) -> tuple:
-        """从表情符号检测情感"""
-        emoji_emotion = None
-        emoji_score = 0
-        
-        # 常见表情符号与情感的映射
-        emoji_mapping = {
-            "😊": "开心", "😂": "开心", "😄": "开心", "😍": "开心", "🥰": "开心",
-            "😠": "生气", "😡": "生气", "🤬": "生气", "💢": "生气",
-            "😢": "悲伤", "😭": "悲伤", "😔": "悲伤", "🥺": "悲伤",
-            "😲": "惊讶", "😮": "惊讶", "🤯": "惊讶", "😱": "惊讶",
-            "😨": "恐惧", "😰": "恐惧", "😥": "恐惧", "😓": "恐惧"
-        }
-        
-        for emoji, emotion in emoji_mapping.items():
-            if emoji in text:
-                emoji_emotion = emotion
-                emoji_score = 2  # 表情符号权重较高
-                break  # 只取第一个匹配的表情符号
-        
-        return emoji_emotion, emoji_score
+    def _is_word_boundary(self, text: str, start: int, end: int, after_modifier: bool = False) -> bool:
+        """检查命中的词语是否满足边界要求（优化的中文匹配）
+
+        after_modifier 为 True 表示词语紧跟在修饰词之后，此时左侧视为边界（如"非常棒"中的"棒"）。
+        """
+        # 多字关键词不容易出现部分匹配问题，直接视为完整匹配
+        # 例如"开心"在"我很开心"中是完整匹配，在"开心果"中也是完整匹配
+        if end - start > 1:
+            return True
+
+        # 单字关键词需要更严格的边界检查，避免"你好"中的"好"被误匹配
+        # 更宽松的边界检查：允许在非中文字符边界出现
+        if not after_modifier and start > 0 and "\u4e00" <= text[start - 1] <= "\u9fff":
+            return False
+        if end < len(text) and "\u4e00" <= text[end] <= "\u9fff":
+            return False
+        return True
+
+    def _scan_symbols(self, text: str) -> tuple:
+        """一次扫描统计表情符号和语气标点
+
+        返回 (各情感的表情符号权重和, 问号数量, 感叹号数量)。
+        """
+        emoji_scores = {}
+        question_marks = 0
+        exclamation_marks = 0
+
+        for match in self.lexicon.symbol_pattern.finditer(text):
+            symbol = match.group()
+            if symbol in QUESTION_MARKS:
+                question_marks += 1
+            elif symbol in EXCLAMATION_MARKS:
+                exclamation_marks += 1
+            else:
+                emotion, weight = self.lexicon.emoji[symbol]
+                emoji_scores[emotion] = emoji_scores.get(emotion, 0.0) + weight
+
+        return emoji_scores, question_marks, exclamation_marks
 
-    def _analyze_tone(self, text: str) -> str:
+    def _analyze_tone(self, text: str, features: tuple = None) -> str:
         """分析文本语气"""
         if not text or len(text.strip()) == 0:
             return "陈述"
@@ -624,42 +1476,42 @@ class MyPlugin(Star):
         
         # 预处理文本
         cleaned_text = self._preprocess_text(text)
+        if features is None:
+            features = self._extract_features(text)
+        symbols, hits = features
         
         # 标点符号分析
-        question_marks = cleaned_text.count("?") + cleaned_text.count("？")
-        exclamation_marks = cleaned_text.count("!") + cleaned_text.count("！")
+        _, question_marks, exclamation_marks = symbols
         
         tone_scores["疑问"] += question_marks * 2
         tone_scores["感叹"] += exclamation_marks * 2
         
-        # 疑问词分析
-        question_words = ["吗", "呢", "什么", "为什么", "怎么", "如何", "是否", "会不会", "能不能", "可不可以", "为何", "哪里", "何时", "谁", "哪个"]
-        for word in question_words:
-            if self._contains_word(cleaned_text, word):
-                tone_scores["疑问"] += 1
-        
-        # 感叹词分析
-        exclamation_words = ["啊", "呀", "哇", "哦", "天哪", "太", "真", "非常", "特别", "超级", "极其", "无比", "简直", "实在"]
-        for word in exclamation_words:
-            if self._contains_word(cleaned_text, word):
-                tone_scores["感叹"] += 1
-        
-        # 句子长度和结构分析
-        sentences = self._split_sentences(text)
-        if sentences:
-            # 如果句子以疑问词开头或结尾
-            first_sentence = sentences[0].lower()
-            last_sentence = sentences[-1].lower()
-            
-            if any(first_sentence.startswith(word) for word in question_words):
-                tone_scores["疑问"] += 2
-            if any(last_sentence.endswith(word) for word in question_words):
-                tone_scores["疑问"] += 1
-                
-            if any(first_sentence.startswith(word) for word in exclamation_words):
-                tone_scores["感叹"] += 2
-            if any(last_sentence.endswith(word) for word in exclamation_words):
-                tone_scores["感叹"] += 1
+        # 句子结构分析：首句开头和末句结尾的位置
+        first_start, last_end = self._sentence_bounds(cleaned_text)
+        starts_with = set()
+        ends_with = set()
+        
+        # 疑问词、感叹词分析：每个词只计分一次
+        matched = set()
+        for start, end, entries in hits:
+            for kind, category, weight in entries:
+                if kind != "tone":
+                    continue
+                # 如果句子以疑问词/感叹词开头或结尾
+                if start == first_start:
+                    starts_with.add(category)
+                if end == last_end:
+                    ends_with.add(category)
+                key = (category, cleaned_text[start:end])
+                if key in matched or not self._is_word_boundary(cleaned_text, start, end):
+                    continue
+                matched.add(key)
+                tone_scores[category] += weight
+        
+        for category in starts_with:
+            tone_scores[category] += 2
+        for category in ends_with:
+            tone_scores[category] += 1
         
         # 找到最高分的语气
         max_tone = "陈述"
@@ -688,12 +1540,16 @@ class MyPlugin(Star):
         
         return max_tone
     
-    def _split_sentences(self, text: str) -> list:
-        """简单分割句子"""
-        # 使用标点符号分割句子
-        import re
-        sentences = re.split(r'[。！？!?]', text)
-        return [s.strip() for s in sentences if s.strip()]
+    def _sentence_bounds(self, text: str) -> tuple:
+        """返回首句开头和末句结尾在文本中的位置（句子以。！？!?分隔并去除空白）"""
+        separators = "。！？!?"
+        first_start = next(
+            (i for i, char in enumerate(text) if char not in separators and not char.isspace()), -1
+        )
+        last_end = next(
+            (i + 1 for i in range(len(text) - 1, -1, -1) if text[i] not in separators and not text[i].isspace()), -1
+        )
+        return first_start, last_end
 
     def _safe_evaluate_condition(self, condition: str, variables: dict) -> bool:
         """安全地评估条件表达式"""
@@ -798,7 +1654,7 @@ class MyPlugin(Star):
             elif level == "ERROR":
                 logger.error(message)
 
-    def _log_detailed_info(self, current_time: datetime, event: AstrMessageEvent, perception_text: str):
+    def _log_detailed_info(self, time_text: str, event: AstrMessageEvent, perception_text: str):
         """输出详细的请求处理信息"""
         if not self.enable_detailed_logging:
             return
@@ -809,7 +1665,7 @@ class MyPlugin(Star):
         
         # 构建详细日志信息
         detailed_info = [
-            f"时间: {current_time.strftime('%Y-%m-%d %H:%M:%S')}",
+            f"时间: {time_text}",
             f"平台: {platform_display}",
             f"消息类型: {message_type}",
             f"感知信息: {perception_text}"
@@ -833,65 +1689,350 @@ class MyPlugin(Star):
     async def my_custom_hook_1(self, event: AstrMessageEvent, req: ProviderRequest):
         # 记录请求开始
         self._log_message("DEBUG", "开始处理LLM请求")
-        
-        # 获取当前时间（使用配置的时区）
-        current_time = datetime.now(self.timezone)
-        
-        # 记录时间信息
-        self._log_message("DEBUG", f"当前时间: {current_time.strftime('%Y-%m-%d %H:%M:%S')}")
-
-        # 基础时间信息
-        timestr = current_time.strftime("%Y-%m-%d %H:%M:%S")
-
-        # 构建感知信息
-        perception_parts = [f"发送时间: {timestr}"]
-
-        # 添加节假日信息
-        holiday_info = self._get_holiday_info(current_time)
-        if holiday_info:
-            perception_parts.append(holiday_info)
-            self._log_message("DEBUG", f"节假日信息: {holiday_info}")
-
-        # 添加平台信息
-        platform_info = self._get_platform_info(event)
-        if platform_info:
-            perception_parts.append(platform_info)
-            self._log_message("DEBUG", f"平台信息: {platform_info}")
-
-        # 添加自定义感知信息
-        custom_info = self._get_custom_perception_info(current_time, event)
-        if custom_info:
-            perception_parts.append(custom_info)
-            self._log_message("DEBUG", f"自定义信息: {custom_info}")
+        platform_name = event.get_platform_name()
+        PERCEPTION_METRICS.inc("requests_total", platform=platform_name)
 
-        # 添加情感感知信息
-        emotion_info = self._get_emotion_info(event)
-        if emotion_info:
-            perception_parts.append(emotion_info)
-            self._log_message("DEBUG", f"情感信息: {emotion_info}")
+        # 同一事件可能多次触发 LLM 请求（如 Agent 工具调用循环），感知信息只计算一次并挂载在事件上复用
+        block = event.get_extra(PERCEPTION_BLOCK_EXTRA_KEY)
+        PERCEPTION_METRICS.cache_hit("event_perception", block is not None)
+        if block is None:
+            block = self._compute_perception_block(event)
+        else:
+            self._log_message("DEBUG", "复用本事件已计算的感知信息")
+        injected_text, truncated = block
 
-        # 组合所有感知信息
-        perception_text = " | ".join(perception_parts)
+        # 幂等：请求中已包含本事件的感知信息时不再重复注入
+        if req.prompt and injected_text in req.prompt:
+            PERCEPTION_METRICS.inc("injections_skipped_total", platform=platform_name)
+            self._log_message("DEBUG", "请求中已包含本事件的感知信息，跳过注入")
+            return
 
         # 记录原始消息长度
         original_length = len(req.prompt) if req.prompt else 0
         
         # 在用户消息前添加感知信息
-        req.prompt = f"[{perception_text}]\n{req.prompt}"
+        req.prompt = f"{injected_text}{req.prompt}"
         
         # 记录处理后的消息长度
         new_length = len(req.prompt) if req.prompt else 0
-        
-        # 输出详细处理信息
-        self._log_detailed_info(current_time, event, perception_text)
+
+        # 统计提示词开销
+        self._account_prompt_usage(event.unified_msg_origin, platform_name, injected_text, truncated)
         
         # 记录处理结果
-        self._log_message("INFO", f"已添加感知信息: {perception_text}")
+        self._log_message("INFO", f"已添加感知信息: {injected_text.strip()}")
         self._log_message("DEBUG", f"消息长度变化: {original_length} -> {new_length} (+{new_length - original_length})")
         
         # 记录请求完成
         self._log_message("DEBUG", "LLM请求处理完成")
 
+    def _compute_perception_block(self, event: AstrMessageEvent) -> tuple:
+        """计算事件的感知记录和注入文本并挂载到事件上，返回 (注入文本, 是否被裁剪)"""
+        # 获取当前时间（使用配置的时区），本次请求的所有阶段共用同一个时间
+        time_snapshot = self.time_context.now()
+        time_text = time_snapshot[1]
+        
+        # 记录时间信息
+        self._log_message("DEBUG", f"当前时间: {time_text}")
+
+        # 计算结构化感知记录，并挂载到事件上供其他插件读取
+        record = self._perceive_event(event, time_snapshot)
+        event.set_extra(PERCEPTION_EXTRA_KEY, record)
+
+        # 渲染感知信息，超出开销上限时按优先级裁剪
+        perception_text, dropped_parts = self._render_within_limit(record)
+        injected_text = f"[{perception_text}]\n"
+        block = (injected_text, bool(dropped_parts))
+        event.set_extra(PERCEPTION_BLOCK_EXTRA_KEY, block)
+
+        # 统计指标
+        self._record_metrics(record, dropped_parts)
+
+        # 输出详细处理信息
+        self._log_detailed_info(time_text, event, perception_text)
+
+        return block
+
+    def _record_metrics(self, record: PerceptionRecord, dropped_parts: tuple = ()):
+        """累加本次计算的感知命中和裁剪指标"""
+        metrics = PERCEPTION_METRICS
+        for part in dropped_parts:
+            metrics.inc("truncations_total", part=part)
+
+        if record.day_status:
+            metrics.inc("day_status_total", status=record.day_status)
+        for holiday in record.holidays:
+            metrics.inc("holiday_hits_total", holiday=holiday)
+        for rule_name, _ in record.rule_outputs:
+            metrics.inc("rule_hits_total", rule=rule_name)
+        if record.emotion:
+            metrics.inc("emotion_total", emotion=record.emotion)
+        if record.tone:
+            metrics.inc("tone_total", tone=record.tone)
+
+    def _exceeds_limit(self, text: str) -> bool:
+        """检查注入内容 "[感知信息]\n" 是否超出开销上限"""
+        if self.max_perception_bytes > 0 and len(text.encode("utf-8")) + 3 > self.max_perception_bytes:
+            return True
+        if self.max_perception_tokens > 0 and estimate_tokens(f"[{text}]\n") > self.max_perception_tokens:
+            return True
+        return False
+
+    def _render_within_limit(self, record: PerceptionRecord) -> tuple:
+        """渲染感知信息，超出上限时按优先级从低到高裁剪感知项，返回 (文本, 被裁剪的感知项)"""
+        text = self.renderer(record)
+        if not self._exceeds_limit(text):
+            return text, ()
+
+        # 候选裁剪项：优先级低的先裁剪，同优先级的自定义规则后触发的先裁剪
+        candidates = [
+            (self.rule_priorities.get(rule_name, 0), -index, f"rule:{rule_name}")
+            for index, (rule_name, _) in enumerate(record.rule_outputs)
+        ]
+        candidates.extend((priority, 0, part) for part, priority in TRUNCATION_PRIORITIES.items())
+        candidates.sort()
+
+        trimmed = record.copy()
+        dropped_parts = []
+        for _, _, part in candidates:
+            # 记录中本就没有的感知项不计入裁剪
+            if not _drop_record_part(trimmed, part):
+                continue
+            trimmed_text = self.renderer(trimmed)
+            # 渲染器本就不输出的值（如文本格式下的中性情感）移除后文本不变，同样不计入
+            if len(trimmed_text) >= len(text):
+                continue
+            text = trimmed_text
+            dropped_parts.append(part)
+            if not self._exceeds_limit(text):
+                break
+
+        # 同一种裁剪只以 WARNING 级别记录一次，之后降为 DEBUG
+        dropped_parts = tuple(dropped_parts)
+        if dropped_parts:
+            message = f"感知信息超出开销上限，已裁剪: {', '.join(dropped_parts)}"
+        else:
+            message = "感知信息超出开销上限，但没有可裁剪的感知项"
+        if dropped_parts not in self._logged_truncations:
+            self._logged_truncations.add(dropped_parts)
+            self._log_message("WARNING", message)
+        else:
+            self._log_message("DEBUG", message)
+
+        return text, dropped_parts
+
+    def _account_prompt_usage(self, session_id: str, platform_name: str, injected_text: str, truncated: bool):
+        """按会话和平台累计注入提示词的开销"""
+        added_bytes = len(injected_text.encode("utf-8"))
+        added_tokens = estimate_tokens(injected_text)
+        PERCEPTION_METRICS.inc("prompt_bytes_added_total", added_bytes, platform=platform_name)
+        PERCEPTION_METRICS.inc("prompt_tokens_added_total", added_tokens, platform=platform_name)
+
+        session_usage = self.session_usage.get(session_id)
+        if session_usage is None:
+            session_usage = {"requests": 0, "bytes": 0, "tokens": 0, "truncated": 0}
+            self.session_usage[session_id] = session_usage
+            if len(self.session_usage) > MAX_TRACKED_SESSIONS:
+                self.session_usage.popitem(last=False)
+        else:
+            self.session_usage.move_to_end(session_id)
+
+        platform_usage = self.platform_usage.setdefault(
+            platform_name, {"requests": 0, "bytes": 0, "tokens": 0, "truncated": 0}
+        )
+
+        for usage in (session_usage, platform_usage):
+            usage["requests"] += 1
+            usage["bytes"] += added_bytes
+            usage["tokens"] += added_tokens
+            usage["truncated"] += int(truncated)
+
+    def _format_usage(self, name: str, usage: dict) -> str:
+        average = usage["bytes"] // usage["requests"] if usage["requests"] else 0
+        return (
+            f"{name}: 请求 {usage['requests']} | 字节 {usage['bytes']} (平均 {average}) | "
+            f"估算 token {usage['tokens']} | 截断 {usage['truncated']}"
+        )
+
+    @filter.command("perception_usage")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    async def perception_usage(self, event: AstrMessageEvent, session: str = ""):
+        """查看感知信息注入提示词的开销，可指定会话 ID，默认显示各平台及开销最大的会话"""
+        if session:
+            usage = self.session_usage.get(session)
+            if usage is None:
+                yield event.plain_result(f"没有会话 {session} 的统计数据")
+            else:
+                yield event.plain_result(self._format_usage(session, usage))
+            return
+
+        lines = ["感知信息提示词开销统计", "[平台]"]
+        for platform_name, usage in sorted(self.platform_usage.items()):
+            platform_display = PLATFORM_DISPLAY_NAMES.get(platform_name, platform_name)
+            lines.append(self._format_usage(f"{platform_display}({platform_name})", usage))
+
+        top_sessions = sorted(self.session_usage.items(), key=lambda item: item[1]["bytes"], reverse=True)[:10]
+        lines.append(f"[会话] 按字节数前 {len(top_sessions)} / 共 {len(self.session_usage)}")
+        for session_id, usage in top_sessions:
+            lines.append(self._format_usage(session_id, usage))
+
+        yield event.plain_result("\n".join(lines))
+
+    def _write_metrics_file(self):
+        """将指标写入配置的文件（先写临时文件再替换，避免采集端读到半个文件）"""
+        try:
+            directory = os.path.dirname(self.metrics_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.metrics_file}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(PERCEPTION_METRICS.render(self.metrics_file_format))
+            os.replace(tmp_path, self.metrics_file)
+        except OSError as e:
+            error_msg = f"写入指标文件失败: {self.metrics_file}, 错误: {e}"
+            self._log_message("WARNING", error_msg)
+            logger.warning(error_msg)
+
+    async def _dump_metrics_periodically(self):
+        """按配置的间隔定时写入指标文件"""
+        while True:
+            await asyncio.sleep(self.metrics_dump_interval)
+            self._write_metrics_file()
+
+    @filter.command("perception_metrics")
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    async def perception_metrics(self, event: AstrMessageEvent, fmt: str = "json"):
+        """查看感知插件的运行指标，fmt 为 json 或 prometheus"""
+        yield event.plain_result(PERCEPTION_METRICS.render(fmt))
+
+    def perceive_batch(self, records: Iterable, batch_size: int = 256) -> Iterator[PerceptionRecord]:
+        """批量感知接口，用于历史消息回放和离线评估
+
+        records 可以是任意可迭代对象（例如逐行读取的聊天记录导出文件），每条记录为 dict
+        或具有同名属性的对象，字段包括 text、timestamp、platform、message_type，
+        以及可选的 has_image/has_audio/has_video。输入按 batch_size 分块流式处理，
+        每块内按阶段批量计算（同一天的节假日、相同文本的情感只计算一次），
+        结果以 PerceptionRecord 生成器逐条产出，顺序与输入一致，原始记录保存在 source 字段。
+        缺少或无法解析 timestamp 的记录会记录警告并跳过，不影响其余记录。
+        """
+        if batch_size <= 0:
+            raise ValueError(f"batch_size 必须为正整数: {batch_size}")
+
+        iterator = iter(records)
+        while True:
+            chunk = list(islice(iterator, batch_size))
+            if not chunk:
+                return
+            yield from self._perceive_chunk(chunk)
+
+    def _perceive_chunk(self, chunk: list) -> Iterator[PerceptionRecord]:
+        """处理一块消息记录：先按阶段批量计算，再逐条组装结果"""
+        normalized = []
+        for record in chunk:
+            try:
+                normalized.append(self._normalize_record(record))
+            except (ValueError, TypeError, OverflowError, OSError) as e:
+                # 单条记录的时间戳无效时跳过该记录，避免中断整个回放流
+                error_msg = f"批量感知跳过无效记录: {e} | 记录: {record!r:.200}"
+                self._log_message("WARNING", error_msg)
+                logger.warning(error_msg)
+
+        # 时间阶段：每个日期只计算一次节假日信息
+        day_facts = {}
+        if self.enable_holiday:
+            for item in normalized:
+                current_date = item["timestamp"].date()
+                if current_date not in day_facts:
+                    day_facts[current_date] = self._get_day_facts(current_date)
+
+        # 文本阶段：相同文本只分析一次
+        text_results = {}
+        if self.enable_emotion:
+            for item in normalized:
+                text = item["text"]
+                if text and text not in text_results:
+                    text_results[text] = self._analyze_text(text)
+
+        for item in normalized:
+            current_time = item["timestamp"]
+            message_facts = (
+                item["platform"],
+                item["message_type"],
+                item["has_image"],
+                item["has_audio"],
+                item["has_video"],
+            )
+            rule_outputs = self._apply_custom_rules({
+                'current_time': current_time,
+                'event': None,
+                'platform_name': item["platform"],
+                'message_type': item["message_type"]
+            })
+
+            yield self._build_record(
+                current_time,
+                current_time.strftime("%Y-%m-%d %H:%M:%S"),
+                self._get_time_period(current_time.hour),
+                day_facts.get(current_time.date()),
+                message_facts,
+                text_results.get(item["text"], ("", "")),
+                rule_outputs,
+                source=item["record"],
+            )
+
+    def _normalize_record(self, record) -> dict:
+        """将批量接口的输入记录规范化为统一字段"""
+        def field(name, default=None):
+            if isinstance(record, Mapping):
+                return record.get(name, default)
+            return getattr(record, name, default)
+
+        message_type = field("message_type")
+        if isinstance(message_type, str):
+            try:
+                message_type = MessageType(message_type)
+            except ValueError:
+                pass
+
+        text = field("text") or ""
+        return {
+            "record": record,
+            "text": str(text).strip(),
+            "timestamp": self._normalize_timestamp(field("timestamp")),
+            "platform": field("platform") or "unknown",
+            "message_type": message_type,
+            "has_image": bool(field("has_image", False)),
+            "has_audio": bool(field("has_audio", False)),
+            "has_video": bool(field("has_video", False)),
+        }
+
+    def _normalize_timestamp(self, timestamp) -> datetime:
+        """将时间戳（datetime、Unix 秒数或 ISO 字符串）转换为配置时区的 datetime
+
+        离线回放时不能使用当前时间代替，缺失或无法解析时抛出 ValueError/TypeError。
+        """
+        if timestamp is None or timestamp == "":
+            raise ValueError("缺少 timestamp")
+        if isinstance(timestamp, datetime):
+            if timestamp.tzinfo is None:
+                # 无时区信息的时间按配置时区解释
+                return timestamp.replace(tzinfo=self.timezone)
+            return timestamp.astimezone(self.timezone)
+        if isinstance(timestamp, bool):
+            raise TypeError(f"无效的 timestamp: {timestamp!r}")
+        if isinstance(timestamp, (int, float)):
+            return datetime.fromtimestamp(timestamp, self.timezone)
+        if isinstance(timestamp, str):
+            return self._normalize_timestamp(datetime.fromisoformat(timestamp.strip()))
+        raise TypeError(f"无效的 timestamp 类型: {type(timestamp).__name__}")
+
     async def terminate(self):
-        """Plugin shutdown hook (currently no-op)."""
-        return
+        """Plugin shutdown hook: stop background tasks and flush a final metrics snapshot."""
+        if self._time_context_task:
+            self._time_context_task.cancel()
+            self._time_context_task = None
+        if self._metrics_task:
+            self._metrics_task.cancel()
+            self._metrics_task = None
+        if self.metrics_file:
+            self._write_metrics_file()
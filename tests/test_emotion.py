@@ -0,0 +1,98 @@
+"""情感与语气规则分析的回归用例
+
+需要在已安装 AstrBot 的环境中运行：python -m pytest tests
+"""
+
+import logging
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("astrbot")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def plugin():
+    logging.disable(logging.CRITICAL)
+    try:
+        yield main.MyPlugin(object(), {"log_level": "ERROR"})
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+# (文本, 情感, 语气)：基础关键词、表情符号和语气标点
+CORPUS = [
+    ("我今天很开心！", "开心", "感叹"),
+    ("你好", "中性", "陈述"),
+    ("你好吗？", "中性", "疑问"),
+    ("太棒了！！", "开心", "感叹"),
+    ("我有点害怕", "恐惧", "陈述"),
+    ("气死了😡", "生气", "陈述"),
+    ("为什么啊？！！", "中性", "疑问感叹"),
+    ("天哪！", "惊讶", "感叹"),
+    ("真的吗", "中性", "感叹"),
+    ("好", "开心", "陈述"),
+    ("好的", "中性", "陈述"),
+    ("好！", "开心", "感叹"),
+    ("这个不错", "开心", "陈述"),
+    ("不幸的是", "悲伤", "陈述"),
+    ("真是太好了", "开心", "感叹"),
+    ("怎么办呢？", "中性", "疑问"),
+    ("哇，没想到居然是你", "惊讶", "感叹"),
+    ("谁啊", "中性", "疑问"),
+    ("啊？", "中性", "感叹疑问"),
+    ("实在太可怕了", "恐惧", "感叹"),
+    ("真", "中性", "感叹"),
+    (" 什么  ", "中性", "疑问"),
+    ("。什么东西", "中性", "疑问"),
+    ("东西什么。", "中性", "疑问"),
+    ("ok 好 ok", "开心", "陈述"),
+    ("简直了！！！", "中性", "感叹"),
+    ("YYDS", "中性", "陈述"),
+    ("难过😭😭 但是开心😊", "悲伤", "陈述"),
+    ("我很担心你会不会生病", "恐惧", "疑问"),
+    ("特别特别喜欢", "开心", "感叹"),
+    ("烦死了烦死了", "中性", "陈述"),
+    ("可以的", "中性", "陈述"),
+    ("收到，明白", "中性", "陈述"),
+    ("非常失望。", "悲伤", "感叹"),
+    ("哦", "惊讶", "感叹"),
+    ("呢", "中性", "疑问"),
+    ("吗？吗？", "中性", "疑问"),
+]
+
+# (文本, 情感)：否定词、程度副词和弱化词
+MODIFIER_CASES = [
+    ("非常棒", "开心"),
+    ("太棒", "开心"),
+    ("真棒", "开心"),
+    ("特别棒", "开心"),
+    ("很烦", "生气"),
+    ("有点烦", "生气"),
+    ("不烦", "中性"),
+    ("不好", "中性"),
+    ("不太好", "中性"),
+    ("你好", "中性"),
+    ("不开心", "中性"),
+    ("不是很开心", "中性"),
+    ("别生气", "中性"),
+    # 单字否定词出现在普通词语中时不生效
+    ("别人都很开心", "开心"),
+    ("未来很开心", "开心"),
+    ("无聊但开心", "开心"),
+]
+
+
+@pytest.mark.parametrize("text, emotion, tone", CORPUS)
+def test_corpus(plugin, text, emotion, tone):
+    assert plugin._analyze_text(text) == (emotion, tone)
+
+
+@pytest.mark.parametrize("text, emotion", MODIFIER_CASES)
+def test_modifiers(plugin, text, emotion):
+    assert plugin._analyze_text(text)[0] == emotion